@@ -1,9 +1,15 @@
 import streamlit as st
 import pandas as pd
+from pandas.api.types import union_categoricals
+import numpy as np
 import io
-from collections import defaultdict
-import tempfile
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import importlib.util
 import os
+import zipfile
+from xml.etree import ElementTree
 
 # Page configuration
 st.set_page_config(
@@ -13,17 +19,62 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Oldest log entries are dropped beyond this limit
+MAX_LOG_ENTRIES = 500
+
 # Initialize session state
 if 'merged_data' not in st.session_state:
     st.session_state.merged_data = defaultdict(list)
 if 'processed_files' not in st.session_state:
     st.session_state.processed_files = set()
 if 'processing_log' not in st.session_state:
-    st.session_state.processing_log = []
+    st.session_state.processing_log = deque(maxlen=MAX_LOG_ENTRIES)
+if 'excel_cache' not in st.session_state:
+    st.session_state.excel_cache = {}
+if 'counts_cache' not in st.session_state:
+    st.session_state.counts_cache = {}
+
+# Sheet entries in the xl/workbook.xml manifest of an .xlsx archive, and the
+# relationships that tell worksheets apart from chartsheets
+_SHEET_TAG = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheet'
+_SHEET_RID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+_RELATIONSHIP_TAG = '{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'
+_WORKSHEET_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+
+# Prefer xlsxwriter for downloads (faster to write); fall back to openpyxl when it is not installed
+EXCEL_WRITER_ENGINE = 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') else 'openpyxl'
+
+# Characters ignored when comparing sheet names
+_NORM_TBL = str.maketrans('', '', ' _')
 
+@functools.lru_cache(maxsize=4096)
 def normalize_sheet_name(name):
     """Normalize sheet name for case and space insensitive comparison"""
-    return str(name).strip().lower().replace(' ', '').replace('_', '')
+    return str(name).strip().lower().translate(_NORM_TBL)
+
+def read_sheet_names(buffer):
+    """Read worksheet names from the workbook manifest without loading styles or shared strings
+    
+    Chartsheets are left out, matching pd.ExcelFile.sheet_names. Returns None if the
+    manifest is not at the standard location or lists no worksheets.
+    """
+    with zipfile.ZipFile(buffer) as archive:
+        try:
+            manifest = archive.read('xl/workbook.xml')
+            relationships = archive.read('xl/_rels/workbook.xml.rels')
+        except KeyError:
+            return None
+    worksheet_ids = {
+        rel.get('Id')
+        for rel in ElementTree.fromstring(relationships).iter(_RELATIONSHIP_TAG)
+        if rel.get('Type') == _WORKSHEET_TYPE
+    }
+    sheet_names = [
+        sheet.get('name')
+        for sheet in ElementTree.fromstring(manifest).iter(_SHEET_TAG)
+        if sheet.get(_SHEET_RID) in worksheet_ids
+    ]
+    return sheet_names or None
 
 def log_message(message, msg_type="info"):
     """Add message to processing log"""
@@ -32,74 +83,129 @@ def log_message(message, msg_type="info"):
         'type': msg_type
     })
 
-def process_excel_file(file, target_sheets):
-    """Process a single Excel file and extract matching sheets"""
-    results = defaultdict(list)
+def compact_columns(df):
+    """Convert low-cardinality text columns to category dtype to save memory"""
+    for column in df.select_dtypes(include=['object', 'string']).columns:
+        if df[column].nunique() < 0.5 * len(df):
+            df[column] = df[column].astype('category')
+    return df
+
+def sheet_has_data(ws):
+    """Check whether a worksheet has any non-blank cell below the header row"""
+    for row in ws.iter_rows(min_row=2, values_only=True):
+        if any(value is not None for value in row):
+            return True
+    return False
+
+def process_excel_file(file, normalized_targets):
+    """Process a single Excel file and extract matching sheets
+    
+    normalized_targets is a list of (target_sheet, normalized_name) pairs.
+    Returns a dict of target sheet name -> DataFrame, plus the file's log lines.
+    """
+    results = {}
     file_log = []
     
     try:
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
-            tmp_file.write(file.getvalue())
-            tmp_file_path = tmp_file.name
+        # Read uploaded bytes directly from memory
+        buffer = io.BytesIO(file.getvalue())
         
-        # Read Excel file
-        xls = pd.ExcelFile(tmp_file_path)
+        # Read sheet names from the manifest, falling back to openpyxl for non-standard layouts
+        sheet_names = read_sheet_names(buffer)
+        if sheet_names is None:
+            buffer.seek(0)
+            with pd.ExcelFile(buffer, engine='openpyxl', engine_kwargs={'read_only': True}) as xls:
+                sheet_names = xls.sheet_names
         file_log.append(f"📁 Processing file: {file.name}")
-        file_log.append(f"📑 Found {len(xls.sheet_names)} sheets: {', '.join(xls.sheet_names)}")
+        file_log.append(f"📑 Found {len(sheet_names)} sheets: {', '.join(sheet_names)}")
         
         # Create sheet mapping for case-insensitive comparison
         sheet_mapping = {}
-        for sheet_name in xls.sheet_names:
+        for sheet_name in sheet_names:
             normalized = normalize_sheet_name(sheet_name)
             sheet_mapping[normalized] = sheet_name
         
-        # Check for target sheets
-        matches_found = 0
-        for target_sheet in target_sheets:
-            normalized_target = normalize_sheet_name(target_sheet)
-            
+        # Check for target sheets (a target entered twice is only processed once)
+        matched = []
+        for target_sheet, normalized_target in dict.fromkeys(normalized_targets):
             if normalized_target in sheet_mapping:
-                original_sheet = sheet_mapping[normalized_target]
-                
+                matched.append((target_sheet, sheet_mapping[normalized_target]))
+            else:
+                file_log.append(f"   ❌ Sheet '{target_sheet}' not found")
+        
+        # Skip opening the workbook when none of its sheets match
+        if not matched:
+            file_log.append(f"   ❌ No matching sheets found in file")
+            return results, file_log
+        
+        # Open workbook once in read-only mode (cells are only loaded when iterated)
+        buffer.seek(0)
+        with pd.ExcelFile(buffer, engine='openpyxl', engine_kwargs={'read_only': True, 'data_only': True}) as xls:
+            # Detect empty sheets without parsing them into DataFrames
+            original_sheets = []
+            empty_sheets = set()
+            for original_sheet in dict.fromkeys(original for _, original in matched):
                 try:
-                    df = pd.read_excel(tmp_file_path, sheet_name=original_sheet)
-                    
-                    if df.empty:
-                        file_log.append(f"   ⚠️ Sheet '{original_sheet}' is empty")
-                        continue
-                    
-                    # Add all data from this sheet with metadata
-                    for index, row in df.iterrows():
-                        row_data = row.to_dict()
-                        results[target_sheet].append({
-                            'data': row_data,
-                            'source_file': file.name,
-                            'source_sheet': original_sheet,
-                            'row_index': index
-                        })
-                    
-                    matches_found += 1
-                    file_log.append(f"   ✅ Found sheet '{original_sheet}' ({len(df)} rows, {len(df.columns)} columns)")
-                    
+                    if sheet_has_data(xls.book[original_sheet]):
+                        original_sheets.append(original_sheet)
+                    else:
+                        empty_sheets.add(original_sheet)
                 except Exception as e:
                     file_log.append(f"   ❌ Error reading sheet '{original_sheet}': {str(e)}")
-            else:
-                file_log.append(f"   ❌ Sheet '{target_sheet}' not found")
+            
+            # Read all non-empty matching sheets from the same open workbook
+            sheet_dfs = {}
+            if original_sheets:
+                try:
+                    sheet_dfs = xls.parse(sheet_name=original_sheets)
+                except Exception:
+                    # Fall back to one sheet at a time so only the broken sheet is lost
+                    for original_sheet in original_sheets:
+                        try:
+                            sheet_dfs[original_sheet] = xls.parse(sheet_name=original_sheet)
+                        except Exception as e:
+                            file_log.append(f"   ❌ Error reading sheet '{original_sheet}': {str(e)}")
+        
+        matches_found = 0
+        
+        for target_sheet, original_sheet in matched:
+            df = sheet_dfs.get(original_sheet)
+            if original_sheet in empty_sheets or (df is not None and df.empty):
+                file_log.append(f"   ⚠️ Sheet '{original_sheet}' is empty")
+                continue
+            if df is None:
+                continue
+            
+            column_count = len(df.columns)
+            
+            # Add source metadata columns to this sheet's data
+            df = compact_columns(df)
+            single_value_codes = np.zeros(len(df), dtype=np.int8)
+            df['_Source_File'] = pd.Categorical.from_codes(single_value_codes, categories=[file.name])
+            df['_Source_Sheet'] = pd.Categorical.from_codes(single_value_codes, categories=[original_sheet])
+            df['_Original_Row'] = np.arange(len(df), dtype=np.int64)
+            results[target_sheet] = df
+            
+            matches_found += 1
+            file_log.append(f"   ✅ Found sheet '{original_sheet}' ({len(df)} rows, {column_count} columns)")
         
         if matches_found == 0:
             file_log.append(f"   ❌ No matching sheets found in file")
         else:
             file_log.append(f"   ✅ Successfully processed {matches_found} matching sheets")
         
-        # Clean up temporary file
-        os.unlink(tmp_file_path)
-        
     except Exception as e:
         file_log.append(f"❌ Error processing file {file.name}: {str(e)}")
     
     return results, file_log
 
+def combine_chunks(chunks):
+    """Concatenate DataFrame chunks, keeping the source metadata columns as category dtype"""
+    df = pd.concat(chunks, ignore_index=True)
+    for column in ('_Source_File', '_Source_Sheet'):
+        df[column] = union_categoricals([chunk[column] for chunk in chunks])
+    return df
+
 def create_individual_excel_file(sheet_name, data_list):
     """Create individual Excel file for a specific sheet type"""
     if not data_list:
@@ -108,32 +214,68 @@ def create_individual_excel_file(sheet_name, data_list):
     # Create Excel in memory
     output = io.BytesIO()
     
-    # Extract all data and create combined DataFrame
-    all_rows = []
-    
-    for item in data_list:
-        # Add the actual data with source metadata
-        row_data = item['data'].copy()
-        row_data['_Source_File'] = item['source_file']
-        row_data['_Source_Sheet'] = item['source_sheet']
-        row_data['_Original_Row'] = item['row_index']
-        all_rows.append(row_data)
-    
-    # Create DataFrame
-    df_combined = pd.DataFrame(all_rows)
+    # Combine all DataFrames for this sheet type
+    df_combined = combine_chunks(data_list)
     
     # Write to Excel
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+    with pd.ExcelWriter(output, engine=EXCEL_WRITER_ENGINE) as writer:
         df_combined.to_excel(writer, sheet_name='Data', index=False)
     
     output.seek(0)
     return output
 
+def get_cached_excel_file(sheet_name, data_list):
+    """Return prepared Excel bytes for a sheet type, or None if not prepared or outdated"""
+    cached = st.session_state.excel_cache.get(sheet_name)
+    if cached is None or cached[0] != len(data_list):
+        return None
+    return cached[1]
+
+def prepare_excel_file(sheet_name, data_list):
+    """Build Excel bytes for a sheet type, keeping only this sheet's file in memory"""
+    excel_file = create_individual_excel_file(sheet_name, data_list)
+    excel_bytes = excel_file.getvalue() if excel_file else None
+    st.session_state.excel_cache = {sheet_name: (len(data_list), excel_bytes)}
+    return excel_bytes
+
+def count_rows(data_list):
+    """Count total rows across a list of DataFrames"""
+    return sum(len(df) for df in data_list)
+
+def count_source_files(data_list):
+    """Count rows per source file across a list of DataFrames (each chunk comes from one file)"""
+    file_counts = {}
+    for df in data_list:
+        file_name = df['_Source_File'].iloc[0]
+        file_counts[file_name] = file_counts.get(file_name, 0) + len(df)
+    return file_counts
+
+def preview_rows(data_list, limit):
+    """Return the first rows across a list of DataFrames without combining them all"""
+    heads = []
+    remaining = limit
+    for df in data_list:
+        heads.append(df.head(remaining))
+        remaining -= len(heads[-1])
+        if remaining <= 0:
+            break
+    return combine_chunks(heads)
+
+def get_file_counts(sheet_name, data_list):
+    """Return cached per-file row counts for a sheet type, recounting only when new data was merged"""
+    cached = st.session_state.counts_cache.get(sheet_name)
+    if cached is None or cached[0] != len(data_list):
+        cached = (len(data_list), count_source_files(data_list))
+        st.session_state.counts_cache[sheet_name] = cached
+    return cached[1]
+
 def reset_all_data():
     """Reset all session data"""
     st.session_state.merged_data = defaultdict(list)
     st.session_state.processed_files = set()
-    st.session_state.processing_log = []
+    st.session_state.processing_log = deque(maxlen=MAX_LOG_ENTRIES)
+    st.session_state.excel_cache = {}
+    st.session_state.counts_cache = {}
 
 # Main UI
 st.title("📊 Excel Sheet Merger Tool")
@@ -166,7 +308,7 @@ with st.sidebar:
     
     with col2:
         if st.button("📝 Clear Log"):
-            st.session_state.processing_log = []
+            st.session_state.processing_log = deque(maxlen=MAX_LOG_ENTRIES)
             st.success("Log cleared!")
     
     # Statistics
@@ -175,7 +317,7 @@ with st.sidebar:
     st.metric("Sheets Merged", len(st.session_state.merged_data))
     
     if st.session_state.merged_data:
-        total_rows = sum(len(data) for data in st.session_state.merged_data.values())
+        total_rows = sum(count_rows(data) for data in st.session_state.merged_data.values())
         st.metric("Total Rows", total_rows)
 
 # Main content area
@@ -234,26 +376,35 @@ if uploaded_files and target_sheets:
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            # Process files
-            for i, file in enumerate(files_to_process):
-                status_text.text(f"Processing {i+1}/{len(files_to_process)}: {file.name}...")
-                
-                # Process file
-                file_results, file_log = process_excel_file(file, target_sheets)
-                
-                # Add to session data
-                for sheet_name, data_list in file_results.items():
-                    st.session_state.merged_data[sheet_name].extend(data_list)
-                
-                # Add to processed files
-                st.session_state.processed_files.add(file.name)
-                
-                # Add to log
-                for log_entry in file_log:
-                    log_message(log_entry)
+            # Normalize target names once for all files
+            normalized_targets = [(sheet, normalize_sheet_name(sheet)) for sheet in target_sheets]
+            
+            # Process files in parallel; results are collected in upload order
+            executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+            try:
+                futures = [executor.submit(process_excel_file, file, normalized_targets) for file in files_to_process]
                 
-                # Update progress
-                progress_bar.progress((i + 1) / len(files_to_process))
+                for i, (file, future) in enumerate(zip(files_to_process, futures)):
+                    status_text.text(f"Processing {i+1}/{len(files_to_process)}: {file.name}...")
+                    
+                    # Wait for file
+                    file_results, file_log = future.result()
+                    
+                    # Add to session data as one chunk per sheet; chunks are only combined on download
+                    for sheet_name, df in file_results.items():
+                        st.session_state.merged_data[sheet_name].append(df)
+                    
+                    # Add to processed files
+                    st.session_state.processed_files.add(file.name)
+                    
+                    # Add to log as a single entry per file
+                    log_message("  \n".join(file_log))
+                    
+                    # Update progress
+                    progress_bar.progress((i + 1) / len(files_to_process))
+            finally:
+                # Drop queued files without waiting if the script is stopped or rerun mid-loop
+                executor.shutdown(wait=False, cancel_futures=True)
             
             status_text.text("✅ Processing complete!")
             if len(files_to_process) < len(new_files):
@@ -271,7 +422,7 @@ if st.session_state.merged_data:
     col1, col2, col3, col4 = st.columns(4)
     
     total_sheets = len(st.session_state.merged_data)
-    total_rows = sum(len(data) for data in st.session_state.merged_data.values())
+    total_rows = sum(count_rows(data) for data in st.session_state.merged_data.values())
     total_files = len(st.session_state.processed_files)
     
     with col1:
@@ -284,28 +435,36 @@ if st.session_state.merged_data:
         processed_percentage = (len(st.session_state.processed_files) / len(uploaded_files) * 100) if uploaded_files else 0
         st.metric("Processing Progress", f"{processed_percentage:.1f}%")
     
+    # Count contributing files once per sheet for both sections below
+    counts_by_sheet = {
+        sheet_name: get_file_counts(sheet_name, data_list)
+        for sheet_name, data_list in st.session_state.merged_data.items()
+    }
+    
     # Download separate Excel files for each sheet type
     st.subheader("📥 Download separate Excel files for each sheet type:")
     
     for sheet_name, data_list in st.session_state.merged_data.items():
         if data_list:
             # Count files contributing to this sheet
-            file_counts = {}
-            for item in data_list:
-                file_name = item['source_file']
-                file_counts[file_name] = file_counts.get(file_name, 0) + 1
+            file_counts = counts_by_sheet[sheet_name]
             
             # Create download section for this sheet
             col1, col2 = st.columns([3, 1])
             
             with col1:
                 st.write(f"**{sheet_name}**")
-                st.caption(f"{len(data_list)} rows from {len(file_counts)} files")
+                st.caption(f"{count_rows(data_list)} rows from {len(file_counts)} files")
             
             with col2:
-                # Create individual Excel file
-                excel_file = create_individual_excel_file(sheet_name, data_list)
-                if excel_file:
+                # Create individual Excel file only when requested
+                excel_file = get_cached_excel_file(sheet_name, data_list)
+                if excel_file is None:
+                    if st.button("📦 Prepare", key=f"prepare_{sheet_name}"):
+                        prepare_excel_file(sheet_name, data_list)
+                        # Rerun so the Prepare button is replaced by the Download button
+                        st.rerun()
+                else:
                     file_name = f"{sheet_name}.xlsx"
                     st.download_button(
                         label=f"📥 Download",
@@ -320,16 +479,13 @@ if st.session_state.merged_data:
     
     breakdown_data = []
     for sheet_name, data_list in st.session_state.merged_data.items():
-        file_counts = {}
-        for item in data_list:
-            file_name = item['source_file']
-            file_counts[file_name] = file_counts.get(file_name, 0) + 1
+        file_counts = counts_by_sheet[sheet_name]
         
         breakdown_data.append({
             'Sheet Type': sheet_name,
-            'Total Rows': len(data_list),
+            'Total Rows': count_rows(data_list),
             'Files Contributing': len(file_counts),
-            'Sample Files': ', '.join(list(file_counts.keys())[:3]) + ('...' if len(file_counts) > 3 else '')
+            'Sample Files': ', '.join(list(file_counts)[:3]) + ('...' if len(file_counts) > 3 else '')
         })
     
     if breakdown_data:
@@ -340,28 +496,21 @@ if st.session_state.merged_data:
     st.subheader("👀 Data Preview")
     
     for sheet_name, data_list in st.session_state.merged_data.items():
-        with st.expander(f"Preview: {sheet_name} ({len(data_list)} rows)"):
+        row_count = count_rows(data_list)
+        with st.expander(f"Preview: {sheet_name} ({row_count} rows)"):
             if data_list:
                 # Show first few rows of actual data
-                preview_data = []
-                for item in data_list[:5]:  # Show first 5 rows
-                    row_data = item['data'].copy()
-                    row_data['_Source_File'] = item['source_file']
-                    row_data['_Source_Sheet'] = item['source_sheet']
-                    preview_data.append(row_data)
-                
-                if preview_data:
-                    df_preview = pd.DataFrame(preview_data)
-                    st.dataframe(df_preview, use_container_width=True)
-                    if len(data_list) > 5:
-                        st.caption(f"Showing first 5 of {len(data_list)} rows...")
+                df_preview = preview_rows(data_list, 5).drop(columns=['_Original_Row'])
+                st.dataframe(df_preview, use_container_width=True)
+                if row_count > 5:
+                    st.caption(f"Showing first 5 of {row_count} rows...")
 
 # Processing log
 if st.session_state.processing_log:
     with st.expander("📋 Processing Log", expanded=False):
         log_container = st.container()
         with log_container:
-            for log_entry in st.session_state.processing_log[-50:]:  # Show last 50 entries
+            for log_entry in list(st.session_state.processing_log)[-50:]:  # Show last 50 entries
                 if log_entry['type'] == 'error':
                     st.error(log_entry['message'])
                 elif log_entry['type'] == 'warning':
@@ -0,0 +1,28 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("streamlit")
+pytest.importorskip("openpyxl")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+app = importlib.import_module("app")
+
+
+def test_download_round_trip_keeps_every_cell():
+    df = pd.DataFrame({
+        'Name': ['a', 'b', 'c'],
+        'Value': [1, 2, 3],
+        '_Source_File': pd.Categorical(['f.xlsx'] * 3),
+        '_Source_Sheet': pd.Categorical(['Summary'] * 3),
+        '_Original_Row': [0, 1, 2],
+    })
+
+    output = app.create_individual_excel_file('Summary', [df])
+    result = pd.read_excel(output, sheet_name='Data')
+
+    expected = df.astype({'_Source_File': object, '_Source_Sheet': object})
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
@@ -0,0 +1,148 @@
+import importlib
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("streamlit")
+openpyxl = pytest.importorskip("openpyxl")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+app = importlib.import_module("app")
+
+from openpyxl.chart import BarChart, Reference  # noqa: E402
+
+
+class UploadedFile:
+    """Minimal stand-in for Streamlit's UploadedFile"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def make_upload(build, name="book.xlsx"):
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    build(wb)
+    output = io.BytesIO()
+    wb.save(output)
+    return UploadedFile(name, output.getvalue())
+
+
+def add_sheet(wb, title, rows):
+    ws = wb.create_sheet(title)
+    for row in rows:
+        ws.append(row)
+    return ws
+
+
+def run(upload, targets):
+    normalized_targets = [(target, app.normalize_sheet_name(target)) for target in targets]
+    return app.process_excel_file(upload, normalized_targets)
+
+
+def test_chartsheet_is_not_a_target_and_does_not_drop_worksheets():
+    def build(wb):
+        ws = add_sheet(wb, 'S', [['Name', 'Value'], ['a', 1], ['b', 2]])
+        chart = BarChart()
+        chart.add_data(Reference(ws, min_col=2, min_row=1, max_row=3), titles_from_data=True)
+        wb.create_chartsheet('Chart1').add_chart(chart)
+
+    results, log = run(make_upload(build), ['S', 'Chart1'])
+
+    assert list(results) == ['S']
+    assert len(results['S']) == 2
+    assert "   ❌ Sheet 'Chart1' not found" in log
+    assert "📑 Found 1 sheets: S" in log
+
+
+def test_header_only_sheet_is_reported_empty():
+    def build(wb):
+        add_sheet(wb, 'Summary', [['Name', 'Value']])
+
+    results, log = run(make_upload(build), ['summary'])
+
+    assert results == {}
+    assert "   ⚠️ Sheet 'Summary' is empty" in log
+    assert "   ❌ No matching sheets found in file" in log
+
+
+def test_leading_blank_rows_match_plain_read_excel():
+    def build(wb):
+        ws = wb.create_sheet('Data')
+        ws['A2'] = 'Name'
+        ws['B2'] = 'Value'
+        ws['A4'] = 'a'
+        ws['B4'] = 1
+
+    upload = make_upload(build)
+    results, log = run(upload, ['Data'])
+
+    expected = pd.read_excel(io.BytesIO(upload.getvalue()), sheet_name='Data')
+    df = results['Data'].drop(columns=['_Source_File', '_Source_Sheet', '_Original_Row'])
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False, check_categorical=False)
+    assert f"   ✅ Found sheet 'Data' ({len(expected)} rows, {len(expected.columns)} columns)" in log
+
+
+def test_no_matching_sheets():
+    def build(wb):
+        add_sheet(wb, 'Other', [['Name'], ['a']])
+
+    results, log = run(make_upload(build), ['Final MR'])
+
+    assert results == {}
+    assert "   ❌ Sheet 'Final MR' not found" in log
+    assert "   ❌ No matching sheets found in file" in log
+
+
+def test_logged_counts_and_metadata_columns():
+    def build(wb):
+        add_sheet(wb, 'Final MR_AC', [['Name', 'Value'], ['a', 1], ['a', 2], ['b', 3]])
+
+    results, log = run(make_upload(build, name='one.xlsx'), ['final mr ac'])
+
+    df = results['final mr ac']
+    assert "   ✅ Found sheet 'Final MR_AC' (3 rows, 2 columns)" in log
+    assert list(df.columns) == ['Name', 'Value', '_Source_File', '_Source_Sheet', '_Original_Row']
+    assert list(df['_Source_File']) == ['one.xlsx'] * 3
+    assert list(df['_Source_Sheet']) == ['Final MR_AC'] * 3
+    assert list(df['_Original_Row']) == [0, 1, 2]
+
+
+def test_duplicate_target_is_processed_once():
+    def build(wb):
+        add_sheet(wb, 'S', [['Name'], ['a']])
+
+    results, log = run(make_upload(build), ['S', 'S'])
+
+    assert list(results) == ['S']
+    assert sum(line.startswith("   ✅ Found sheet 'S'") for line in log) == 1
+    assert "   ✅ Successfully processed 1 matching sheets" in log
+
+
+def test_parse_failure_only_drops_the_broken_sheet(monkeypatch):
+    original_parse = pd.ExcelFile.parse
+
+    def parse(self, sheet_name=0, **kwargs):
+        names = sheet_name if isinstance(sheet_name, list) else [sheet_name]
+        if 'Bad' in names:
+            raise ValueError("broken sheet")
+        return original_parse(self, sheet_name=sheet_name, **kwargs)
+
+    monkeypatch.setattr(pd.ExcelFile, 'parse', parse)
+
+    def build(wb):
+        add_sheet(wb, 'Good', [['Name'], ['a']])
+        add_sheet(wb, 'Bad', [['Name'], ['b']])
+
+    results, log = run(make_upload(build), ['Good', 'Bad'])
+
+    assert list(results) == ['Good']
+    assert "   ❌ Error reading sheet 'Bad': broken sheet" in log
+    assert "   ✅ Successfully processed 1 matching sheets" in log